@@ -1,36 +1,32 @@
 import os
-import requests
 import socket
 import time
+from urllib.request import urlopen
 from services.data.service_configs import max_startup_retries, \
     startup_retry_wait_time_seconds
 
 port = int(os.environ.get("MF_MIGRATION_PORT", 8082))
 
-try:
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    retry_count = max_startup_retries
-    while retry_count > 0:
-        print(retry_count)
-        try:
-            print("connecting")
-            s.connect(('localhost', port))
+# Wait for the migration service to accept connections. Every attempt uses a fresh socket,
+# as a socket that failed to connect can not be reused for another attempt. The wait between
+# attempts starts short and doubles up to startup_retry_wait_time_seconds, within the same
+# total time budget of max_startup_retries * startup_retry_wait_time_seconds.
+wait_time = min(0.1, startup_retry_wait_time_seconds)
+deadline = time.monotonic() + max_startup_retries * startup_retry_wait_time_seconds
+while True:
+    try:
+        with socket.create_connection(('localhost', port), timeout=1.0):
             print("Port reachable", port)
             break
-        except socket.error as e:
-            print("booting...")
-            print(e)
-            time.sleep(startup_retry_wait_time_seconds)
-        except Exception:
-            print("something broke")
-        finally:
-            retry_count = retry_count - 1
-    # continue
-    s.close()
-except Exception as e:
-    print(e)
+    except OSError as e:
+        print("booting...", e)
+    if time.monotonic() + wait_time > deadline:
+        raise RuntimeError("Migration service did not become reachable on port {0}".format(port))
+    time.sleep(wait_time)
+    wait_time = min(wait_time * 2, startup_retry_wait_time_seconds)
 
-r = requests.get('http://localhost:{0}/version'.format(port))
+with urlopen('http://localhost:{0}/version'.format(port), timeout=5) as r:
+    version = r.read().decode('utf-8')
 conf_file = open('/root/services/migration_service/config', 'w')
-print(r.text, file=conf_file)
+print(version, file=conf_file)
 conf_file.close()
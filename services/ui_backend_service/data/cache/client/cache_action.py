@@ -24,6 +24,10 @@ class CacheAction(object):
 
     PRIORITY = LO_PRIO
 
+    # Whether the cache server holds back a request while a running worker is producing
+    # any of its persistent (non-disposable) keys, so that the request reuses them.
+    HOLD_BACK_SHARED_KEYS = False
+
     @classmethod
     def format_request(cls, *args, **kwargs):
         """
@@ -51,9 +55,10 @@ class CacheAction(object):
     def response(cls, keys_objs):
         """
         Decodes and refines `execute` output before it is returned
-        to the client. The argument `keys_objs` is the return value
-        of `execute`. This method is called by `cache_client` to
-        convert serialized, cached results to a client-facing object.
+        to the client. The argument `keys_objs` is a mapping of the
+        `execute` output whose values are read from disk on first
+        access. This method is called by `cache_client` to convert
+        serialized, cached results to a client-facing object.
 
         The function may return anything.
         """
@@ -93,8 +98,8 @@ class CacheAction(object):
         - `invalidate_cache` boolean to indicate whether to invalidate
           existing cache keys.
 
-        Returns a dictionary that includes a string/byte result
-        per key that will be stored in the cache.
+        Returns a dictionary that includes a string or bytes-like
+        result per key that will be stored in the cache.
         """
         raise NotImplementedError
 
@@ -3,6 +3,7 @@ import json
 import sys
 import hashlib
 import time
+from collections.abc import Mapping
 
 from .cache_store import object_path, stream_path, is_safely_readable
 from .cache_action import Check
@@ -23,6 +24,31 @@ class CacheStreamCorrupted(Exception):
     pass
 
 
+class KeyObjects(Mapping):
+    """
+    Read-only mapping of cache keys to their cached blobs. Files are
+    read on first access, so `response` implementations that only look
+    up the keys they need never load the others into memory.
+    """
+
+    def __init__(self, key_paths):
+        self._key_paths = key_paths
+        self._blobs = {}
+
+    def __getitem__(self, key):
+        if key not in self._blobs:
+            path = self._key_paths[key]
+            with open(path, 'rb') as f:
+                self._blobs[key] = f.read()
+        return self._blobs[key]
+
+    def __iter__(self):
+        return iter(self._key_paths)
+
+    def __len__(self):
+        return len(self._key_paths)
+
+
 class CacheFuture(object):
 
     def __init__(self, keys, stream_key, client, action_cls, root):
@@ -54,15 +80,11 @@ class CacheFuture(object):
                                 timeout)
 
     def get(self):
-        def _read(path):
-            with open(path, 'rb') as f:
-                return f.read()
-
         _safe_key_paths = {key: path for key, path in self.key_paths.items() if is_safely_readable(path)}
         if self.key_objs is None and self.is_ready():
-            self.key_objs = {key: _read(path)
-                             for key, path in _safe_key_paths.items()
-                             if key != self.stream_key}
+            self.key_objs = KeyObjects({key: path
+                                        for key, path in _safe_key_paths.items()
+                                        if key != self.stream_key})
 
         if self.key_objs:
             return self.action.response(self.key_objs)
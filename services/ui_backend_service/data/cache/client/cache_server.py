@@ -5,6 +5,7 @@ import json
 import uuid
 import time
 import fcntl
+import threading
 import multiprocessing
 from datetime import datetime
 from collections import deque
@@ -24,6 +25,11 @@ from .cache_store import CacheStore,\
     key_filename,\
     is_safely_readable
 
+# Reserved keys are normally released when their worker terminates, but a pool process that dies
+# never reports back. Reservations older than this are ignored, so that requests held back by them
+# are not stuck forever. A worker that is merely slow only costs duplicate work after the timeout.
+INFLIGHT_KEYS_TIMEOUT_SECONDS = 300
+
 
 def send_message(op: str, data: dict):
     print(json.dumps({
@@ -93,7 +99,7 @@ def subprocess_cmd_and_env(mod):
 
 class Worker(object):
 
-    def __init__(self, request, filestore, pool, callback=None, error_callback=None):
+    def __init__(self, request, filestore, pool, callback=None, error_callback=None, terminate_callback=None):
         self.uuid = uuid.uuid4()
         self.request = request
         self.prio = request['priority']
@@ -101,6 +107,7 @@ class Worker(object):
         self.pool = pool
         self.callback = callback
         self.error_callback = error_callback
+        self.terminate_callback = terminate_callback
 
         try:
             self.tempdir = self.filestore.open_tempdir(
@@ -159,17 +166,24 @@ class Worker(object):
         echo("Worker%s[token %s] %s" % (uuid_prefix, token, msg))
 
     def terminate(self):
-        missing = self.filestore.commit(self.tempdir,
-                                        self.request['keys'],
-                                        self.request['stream_key'],
-                                        self.request['disposable_keys'])
-        if missing:
-            self.echo("failed to produce the following keys: %s"
-                      % ','.join(missing))
-
-        self.filestore.close_tempdir(self.tempdir)
-
-        send_message(OP_WORKER_TERMINATE, self._worker_details())
+        try:
+            missing = self.filestore.commit(self.tempdir,
+                                            self.request['keys'],
+                                            self.request['stream_key'],
+                                            self.request['disposable_keys'])
+            if missing:
+                self.echo("failed to produce the following keys: %s"
+                          % ','.join(missing))
+
+            self.filestore.close_tempdir(self.tempdir)
+
+            send_message(OP_WORKER_TERMINATE, self._worker_details())
+        finally:
+            if self.terminate_callback:
+                try:
+                    self.terminate_callback(self)
+                except:
+                    pass
 
     def _worker_details(self):
         return {
@@ -191,8 +205,17 @@ class Scheduler(object):
         self.lo_prio_requests = deque()
         self.hi_prio_requests = deque()
         self.actions = []
+        self.hold_back_actions = frozenset()
         self.workers = []
 
+        # Persistent (non-disposable) keys that running workers are producing, for actions with HOLD_BACK_SHARED_KEYS.
+        # Requests sharing any of these keys are held back until the worker has committed them,
+        # so that concurrent requests for the same object reuse the result instead of all
+        # computing it, e.g. multiple pages of the same log file.
+        # Workers terminate in the pool's result thread, hence the lock.
+        self.inflight_keys = {}  # key -> (idempotency_token, reserved_at)
+        self.inflight_keys_lock = threading.Lock()
+
         self.pool = multiprocessing.Pool(
             processes=max_workers,
             initializer=self.init_process,
@@ -214,6 +237,9 @@ class Scheduler(object):
                 actions = msg['message']['actions']
                 self.validate_actions(actions)
                 self.actions = frozenset('.'.join(act) for act in actions)
+                self.hold_back_actions = frozenset(
+                    '.'.join(act) for act in actions
+                    if import_action_class(*act).HOLD_BACK_SHARED_KEYS)
             elif op == 'action':
                 if action not in self.actions:
                     raise CacheServerException("Unknown action: '%s'" % action)
@@ -241,12 +267,19 @@ class Scheduler(object):
 
     def schedule(self):
         def queued_request(queue):
-            while queue:
-                yield queue.popleft()
+            # go through the queue once, putting back requests that have to wait
+            # for a running worker to produce their keys.
+            for _ in range(len(queue)):
+                request = queue.popleft()
+                if self.reserve_keys(request):
+                    yield request
+                else:
+                    queue.append(request)
 
         for request in chain(queued_request(self.hi_prio_requests),
                              queued_request(self.lo_prio_requests)):
-            worker = Worker(request, self.filestore, self.pool, self._callback, self._error_callback)
+            worker = Worker(request, self.filestore, self.pool, self._callback, self._error_callback,
+                            self._terminate_callback)
             try:
                 if worker.tempdir:
                     worker.start()
@@ -254,9 +287,38 @@ class Scheduler(object):
             except Exception as ex:
                 echo("Failed to start worker %s" % ex)
 
+            self.release_keys(request)
             send_message(OP_WORKER_TERMINATE, worker._worker_details())
             return None
 
+    def reserve_keys(self, request):
+        "mark the persistent keys of the request as in-flight, unless another worker is already producing any of them"
+        if request['action'] not in self.hold_back_actions:
+            return True
+        keys = persistent_keys(request)
+        token = request['idempotency_token']
+        now = time.monotonic()
+        with self.inflight_keys_lock:
+            for key in keys:
+                reservation = self.inflight_keys.get(key)
+                if reservation and reservation[0] != token and \
+                        now - reservation[1] < INFLIGHT_KEYS_TIMEOUT_SECONDS:
+                    return False
+            for key in keys:
+                self.inflight_keys[key] = (token, now)
+            return True
+
+    def release_keys(self, request):
+        "release the keys reserved by the request. Keys reserved since by another request are left as is."
+        if request['action'] not in self.hold_back_actions:
+            return
+        token = request['idempotency_token']
+        with self.inflight_keys_lock:
+            for key in persistent_keys(request):
+                reservation = self.inflight_keys.get(key)
+                if reservation and reservation[0] == token:
+                    del self.inflight_keys[key]
+
     def loop(self):
         def new_worker_from_request():
             worker = self.schedule()
@@ -280,6 +342,16 @@ class Scheduler(object):
         self.pending_requests.remove(token)
         self.workers.remove(worker)
 
+    def _terminate_callback(self, worker):
+        # keys are released only after the worker has committed them to the store,
+        # so that held back requests find them as existing keys.
+        self.release_keys(worker.request)
+
+
+def persistent_keys(request):
+    "keys of a request that are kept in the cache, as opposed to disposable per-request keys"
+    return frozenset(request['keys']) - frozenset(request['disposable_keys'] or [])
+
 
 @click.command()
 @click.option("--root",
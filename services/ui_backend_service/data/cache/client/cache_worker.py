@@ -61,7 +61,7 @@ def execute(tempdir, action_cls, req):
                 # Reduce disk churn by not unnecessarily writing existing keys
                 # that have identical values to the newly produced ones.
                 continue
-            blob = val if isinstance(val, bytes) else val.encode('utf-8')
+            blob = val.encode('utf-8') if isinstance(val, str) else val
             with open(os.path.join(tempdir, req['keys'][key]), 'wb') as f:
                 f.write(blob)
     finally:
@@ -1,7 +1,18 @@
 import hashlib
 import json
-
-from typing import Dict, List, Optional, Tuple
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import islice
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 from .client import CacheAction
 from .utils import streamed_errors
 
@@ -13,6 +24,29 @@ namespace(None)  # Always use global namespace by default
 STDOUT = 'log_location_stdout'
 STDERR = 'log_location_stderr'
 
+# Legacy logs are fetched as the raw log text, other logs as (timestamp, line) tuples.
+LogContent = Union[str, Iterable[Tuple[Optional[int], str]]]
+
+# Log files are cached in a packed binary format, so that pages can be served without
+# decoding the whole log:
+#   header: magic, log size (int64), line count (uint32)
+#   text: utf-8 loglines, each terminated by a newline
+#   timestamps: timestamp in ms of each line (int64, 0 when missing)
+#   line starts: offset of each line in the packed log, followed by the end of the text (uint64)
+# The arrays use native byte order, as the cache is local to the host.
+_MAGIC = b"LOG\x04"
+_HEADER = struct.Struct("<4sqI")
+
+# The UI polls logs frequently, so log sizes are kept in-process for a short while
+# instead of asking the Metaflow metadata for them on every request.
+# Sizes of attempts that finished before the TTL are kept until evicted.
+LOG_SIZE_CACHE_TTL_SECONDS = 5
+LOG_SIZE_CACHE_MAX_ITEMS = 1024
+
+# When a log has grown, the end of the previously packed text is compared with the new content
+# before the packed lines are reused, to catch logs that have been rewritten.
+LOG_TAIL_CHECK_BYTES = 4096
+
 
 class GetLogFile(CacheAction):
     """
@@ -62,6 +96,9 @@ class GetLogFile(CacheAction):
         }
     """
 
+    # pages of the same log share the log file key, which is then only fetched once.
+    HOLD_BACK_SHARED_KEYS = True
+
     @classmethod
     def format_request(cls, task: Dict, logtype: str = STDOUT,
                        limit: int = 0, page: int = 1,
@@ -76,8 +113,9 @@ class GetLogFile(CacheAction):
             'raw_log': raw_log
         }
         log_key = log_cache_id(task, logtype)
-        result_key = log_result_id(task, logtype, limit, page, reverse_order, raw_log)
-        stream_key = 'log:stream:%s' % lookup_id(task, logtype, limit, page, reverse_order, raw_log)
+        request_id = lookup_id(log_key, limit, page, reverse_order, raw_log)
+        result_key = 'log:result:%s' % request_id
+        stream_key = 'log:stream:%s' % request_id
 
         return msg,\
             [log_key, result_key],\
@@ -89,9 +127,11 @@ class GetLogFile(CacheAction):
     def response(cls, keys_objs):
         '''
         Return the cached log content
+
+        Only the result key is read; the packed log file stays on disk.
         '''
         return [
-            json.loads(val) for key, val in keys_objs.items()
+            _json_loads(keys_objs[key]) for key in keys_objs
             if key.startswith('log:result')][0]
 
     @classmethod
@@ -120,29 +160,49 @@ class GetLogFile(CacheAction):
         pathspec = pathspec_for_task(task_dict)
 
         # keys
-        log_key = log_cache_id(task_dict, logtype)
-        result_key = log_result_id(task_dict, logtype, limit, page, reverse, output_raw)
+        log_key = log_cache_id(task_dict, logtype, pathspec)
+        result_key = log_result_id(log_key, limit, page, reverse, output_raw)
 
         previous_log_file = existing_keys.get(log_key, None)
-        previous_log_size = json.loads(previous_log_file).get("log_size", None) if previous_log_file else None
+        log_file = PackedLog(previous_log_file) if is_packed_log(previous_log_file) else None
+        previous_log_size = log_file.log_size if log_file else None
 
         log_size_changed = False  # keep track if we loaded new content
         with streamed_errors(stream_output):
-            task = Task(pathspec, attempt=attempt)
+            task = None
             # check if log has grown since last time.
-            current_size = get_log_size(task, logtype)
+            size_key = (pathspec, attempt, logtype)
+            current_size = get_cached_log_size(size_key)
+            if current_size is None or current_size != previous_log_size:
+                # the cached size is local to this process, while the packed log is shared by all workers.
+                # It is only trusted to confirm that the packed log is up to date, otherwise it might be stale.
+                task = get_task(pathspec, attempt)
+                current_size = get_log_size(task, logtype)
+                cache_log_size(size_key, current_size, _attempt_finished(task_dict))
             log_size_changed = previous_log_size is None or previous_log_size != current_size
 
             if log_size_changed:
+                if task is None:
+                    task = get_task(pathspec, attempt)
                 content = get_log_content(task, logtype)
-                results[log_key] = json.dumps({"log_size": current_size, "content": content})
+                packed = None
+                if log_file is not None and current_size > previous_log_size:
+                    # the log has most likely been appended to, so only the new lines need to be packed.
+                    packed = log_file.extended(current_size, content)
+                    if packed is None:
+                        # the log has been rewritten, which is rare enough to fetch it again.
+                        content = get_log_content(task, logtype)
+                if packed is None:
+                    packed = pack_log(current_size, content)
+                results[log_key] = packed
+                log_file = PackedLog(results[log_key])
             else:
                 results = {**existing_keys}
 
         if log_size_changed or result_key not in existing_keys:
-            results[result_key] = json.dumps(
+            results[result_key] = _json_dumps(
                 paginated_result(
-                    json.loads(results[log_key])["content"],
+                    log_file,
                     page,
                     limit,
                     reverse,
@@ -152,14 +212,54 @@ class GetLogFile(CacheAction):
 
         return results
 
+
 # Utilities
 
 
+def get_task(pathspec: str, attempt: int) -> Task:
+    return Task(pathspec, attempt=attempt)
+
+
 def get_log_size(task: Task, logtype: str):
     return task.stderr_size if logtype == STDERR else task.stdout_size
 
 
-def get_log_content(task: Task, logtype: str):
+_log_size_cache = OrderedDict()  # (pathspec, attempt, logtype) -> (expires_at, log_size)
+
+
+def get_cached_log_size(key: Tuple[str, int, str]) -> Optional[int]:
+    "return the cached log size for the key, or None if there is no valid cached size"
+    cached = _log_size_cache.get(key)
+    if cached is None:
+        return None
+    expires_at, log_size = cached
+    if expires_at is not None and expires_at < time.monotonic():
+        del _log_size_cache[key]
+        return None
+    _log_size_cache.move_to_end(key)
+    return log_size
+
+
+def cache_log_size(key: Tuple[str, int, str], log_size: int, finished: bool = False):
+    "cache a log size, indefinitely for finished attempts and for LOG_SIZE_CACHE_TTL_SECONDS otherwise"
+    expires_at = None if finished else time.monotonic() + LOG_SIZE_CACHE_TTL_SECONDS
+    _log_size_cache[key] = (expires_at, log_size)
+    _log_size_cache.move_to_end(key)
+    while len(_log_size_cache) > LOG_SIZE_CACHE_MAX_ITEMS:
+        _log_size_cache.popitem(last=False)
+
+
+def _attempt_finished(task: Dict) -> bool:
+    "whether the task attempt finished long enough ago for its logs to be complete"
+    # finished_at alone does not mean that the attempt has finished,
+    # as it falls back to the last heartbeat when heartbeats have lapsed.
+    if task.get('attempt_ok') is None:
+        return False
+    finished_at = task.get('finished_at')
+    return finished_at is not None and finished_at < (time.time() - LOG_SIZE_CACHE_TTL_SECONDS) * 1000
+
+
+def get_log_content(task: Task, logtype: str) -> LogContent:
     # NOTE: this re-implements some of the client logic from _load_log(self, stream)
     # for backwards compatibility of different log types.
     # Necessary due to the client not exposing a stdout/stderr property that would
@@ -167,20 +267,23 @@ def get_log_content(task: Task, logtype: str):
     stream = 'stderr' if logtype == STDERR else 'stdout'
     log_location = task.metadata_dict.get('log_location_%s' % stream)
     if log_location:
-        return [
-            (None, line)
-            for line in task._load_log_legacy(log_location, stream).split("\n")
-        ]
+        # Legacy logs have no timestamps, so there is no need to split them into lines
+        # before a page of them is requested.
+        return task._load_log_legacy(log_location, stream)
     else:
-        return [
+        # lines are packed as they are read, without collecting them in a list first
+        return (
             (_datetime_to_epoch(datetime), line)
             for datetime, line in task.loglines(stream)
-        ]
+        )
 
 
-def paginated_result(content: List[Tuple[Optional[int], str]], page: int = 1, limit: int = 0, reverse_order: bool = False, output_raw=False):
+def paginated_result(content: Sequence[Tuple[Optional[int], str]], page: int = 1, limit: int = 0, reverse_order: bool = False, output_raw=False):
     if not output_raw:
         loglines, total_pages = format_loglines(content, page, limit, reverse_order)
+    elif isinstance(content, PackedLog):
+        loglines = content.text()
+        total_pages = 1
     else:
         loglines = "\n".join(line for _, line in content)
         total_pages = 1
@@ -191,64 +294,222 @@ def paginated_result(content: List[Tuple[Optional[int], str]], page: int = 1, li
     }
 
 
-def format_loglines(content: List[Tuple[Optional[int], str]], page: int = 1, limit: int = 0, reverse: bool = False) -> Tuple[List, int]:
+def format_loglines(content: Sequence[Tuple[Optional[int], str]], page: int = 1, limit: int = 0, reverse: bool = False) -> Tuple[List, int]:
     "format, order and limit the log content. Return a list of log lines with row numbers"
-    lines = [
-        {"row": row, "timestamp": line[0], "line": line[1]}
-        for row, line in enumerate(content)
-    ]
-
-    _offset = limit * (page - 1)
-    pages = max(len(lines) // limit, 1) if limit else 1
+    total = len(content)
+    pages = max(total // limit, 1) if limit else 1
     if pages < page:
         # guard against OOB page requests
         return [], pages
 
+    # compute the requested window in original row order,
+    # so that we only format the lines that are going to be returned.
+    _offset = limit * (page - 1)
     if reverse:
-        lines = lines[::-1]
+        stop = max(total - _offset, 0)
+        start = max(stop - limit, 0) if limit else 0
+    else:
+        start = min(_offset, total)
+        stop = min(start + limit, total) if limit else total
 
-    if limit:
-        lines = lines[_offset:][:limit]
+    if reverse:
+        # walk the window backwards by index instead of slicing and reversing a copy of it
+        rows = range(stop - 1, start - 1, -1)
+        window = (content[row] for row in rows)
+    else:
+        rows = range(start, stop)
+        window = content[start:stop]
 
-    return lines, pages
+    return [
+        {"row": row, "timestamp": line[0], "line": line[1]}
+        for row, line in zip(rows, window)
+    ], pages
 
 
-def log_cache_id(task: Dict, logtype: str):
-    "construct a unique cache key for log file location"
-    return "log:file:{pathspec}.{attempt_id}.{logtype}".format(
-        pathspec=pathspec_for_task(task),
-        attempt_id=task.get("attempt_id", 0),
-        logtype=logtype
-    )
+def pack_log(log_size: int, content: LogContent) -> bytearray:
+    """
+    pack the log content into the binary format used for caching log files.
+    The log is packed in place into a single buffer, which is returned without copying it to bytes.
+    """
+    buf = bytearray(_HEADER.size)
+    starts = array('Q', [_HEADER.size])
+    if isinstance(content, str):
+        buf += content.encode('utf-8')
+        return _pack_text(buf, starts, log_size)
+    return _pack_lines(buf, starts, array('q'), content, log_size)
+
+
+def _pack_text(buf: bytearray, starts: array, log_size: int) -> bytearray:
+    "index the legacy log text in buf from the last line start on, and finish packing it"
+    # legacy logs have no timestamps, and their text is kept as is.
+    # Only the line starts are collected, by scanning for newlines.
+    buf += b"\n"
+    add_start = starts.append
+    find = buf.find
+    pos = find(b"\n", starts[-1])
+    while pos != -1:
+        add_start(pos + 1)
+        pos = find(b"\n", pos + 1)
+    count = len(starts) - 1
+    buf += bytes(array('q').itemsize * count)
+    buf += starts
+    _HEADER.pack_into(buf, 0, _MAGIC, log_size, count)
+    return buf
+
+
+def _pack_lines(buf: bytearray, starts: array, timestamps: array, lines: Iterable[Tuple[Optional[int], str]], log_size: int) -> bytearray:
+    "append the lines to buf, and finish packing it"
+    # the per line loop dominates packing time for large logs,
+    # so the methods used in it are bound to locals.
+    add_start = starts.append
+    add_timestamp = timestamps.append
+    for timestamp, line in lines:
+        buf += line.encode('utf-8')
+        buf += b"\n"
+        add_start(len(buf))
+        add_timestamp(timestamp or 0)
+    count = len(timestamps)
+    buf += timestamps
+    buf += starts
+    _HEADER.pack_into(buf, 0, _MAGIC, log_size, count)
+    return buf
+
+
+def is_packed_log(blob: Optional[Union[bytes, bytearray]]) -> bool:
+    "check whether a cached value is a log file packed with pack_log"
+    return bool(blob) and blob[:len(_MAGIC)] == _MAGIC
+
+
+class PackedLog(Sequence):
+    """
+    Read-only sequence of (timestamp, line) tuples backed by a log packed with pack_log.
 
+    Only the header is read on creation, loglines are decoded when they are accessed.
+    """
 
-def log_result_id(task: Dict, logtype: str, limit: int = 0, page: int = 1, reverse_order: bool = False, raw_log: bool = False):
+    def __init__(self, blob: Union[bytes, bytearray]):
+        _, self.log_size, self._count = _HEADER.unpack_from(blob, 0)
+        self._view = memoryview(blob)
+        starts_at = len(blob) - (self._count + 1) * array('Q').itemsize
+        timestamps_at = starts_at - self._count * array('q').itemsize
+        self._timestamps = self._view[timestamps_at:starts_at].cast('q')
+        self._starts = self._view[starts_at:].cast('Q')
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return self._iter_rows(0, self._count)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._count)
+            if step != 1:
+                return [self[row] for row in range(start, stop, step)]
+            return list(self._iter_rows(start, max(start, stop)))
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("log row out of range")
+        return self._read_row(index)
+
+    def text(self) -> str:
+        "the whole log as text"
+        return str(self._view[_HEADER.size:self._starts[-1] - 1], 'utf-8') if self._count else ""
+
+    def extended(self, log_size: int, content: LogContent) -> Optional[bytearray]:
+        """
+        pack the content of a log that has grown since it was packed into this one, reusing the text and index
+        of the packed rows instead of encoding every line again. The last row is always read again, as it might have been incomplete.
+
+        If the end of the previously packed text does not match the new content, the log has been rewritten.
+        Legacy text is then packed from scratch, while None is returned for loglines,
+        as the skipped lines are not kept and the log has to be fetched again.
+        """
+        keep = max(self._count - 1, 0)
+        prev_starts = self._starts
+        kept_end = prev_starts[keep]
+        check_from = max(kept_end - LOG_TAIL_CHECK_BYTES, _HEADER.size)
+        starts = array('Q')
+        starts.frombytes(prev_starts[:keep + 1].cast('B'))
+
+        if isinstance(content, str):
+            # legacy text has to be encoded as a whole anyway, only the newline scan of the kept rows is saved.
+            encoded = content.encode('utf-8')
+            if encoded[check_from - _HEADER.size:kept_end - _HEADER.size] != self._view[check_from:kept_end]:
+                starts = array('Q', [_HEADER.size])
+            buf = bytearray(_HEADER.size)
+            buf += encoded
+            return _pack_text(buf, starts, log_size)
+
+        # the kept rows are skipped without encoding or keeping them, apart from the ones in the tail that is compared.
+        check_row = bisect_left(prev_starts, check_from)
+        prev_timestamps = self._timestamps
+        rows = iter(content)
+        row = -1
+        for row, (timestamp, line) in enumerate(islice(rows, keep)):
+            if row < check_row:
+                continue
+            same_timestamp = (timestamp or 0) == prev_timestamps[row]
+            same_line = line.encode('utf-8') == self._view[prev_starts[row]:prev_starts[row + 1] - 1]
+            if not (same_timestamp and same_line):
+                return None
+        if row + 1 < keep:
+            return None
+
+        timestamps = array('q')
+        timestamps.frombytes(prev_timestamps[:keep].cast('B'))
+        return _pack_lines(bytearray(self._view[:kept_end]), starts, timestamps, rows, log_size)
+
+    def _read_row(self, row: int) -> Tuple[Optional[int], str]:
+        line = self._view[self._starts[row]:self._starts[row + 1] - 1]
+        return self._timestamps[row] or None, str(line, 'utf-8')
+
+    def _iter_rows(self, start: int, stop: int) -> Iterator[Tuple[Optional[int], str]]:
+        for row in range(start, stop):
+            yield self._read_row(row)
+
+
+def log_cache_id(task: Dict, logtype: str, pathspec: Optional[str] = None):
+    "construct a unique cache key for log file location. Pass in pathspec if it has already been computed for the task."
+    if pathspec is None:
+        pathspec = pathspec_for_task(task)
+    return f"log:file:{pathspec}.{task.get('attempt_id', 0)}.{logtype}"
+
+
+def log_result_id(log_key: str, limit: int = 0, page: int = 1, reverse_order: bool = False, raw_log: bool = False):
     "construct a unique cache key for a paginated log response"
-    return "log:result:%s" % lookup_id(task, logtype, limit, page, reverse_order, raw_log)
+    return "log:result:%s" % lookup_id(log_key, limit, page, reverse_order, raw_log)
 
 
-def lookup_id(task: Dict, logtype: str, limit: int = 0, page: int = 1, reverse_order: bool = False, raw_log: bool = False):
-    "construct a unique id to be used with stream_key and result_key"
-    _string = "{file}_{limit}_{page}_{reverse}_{raw}".format(
-        file=log_cache_id(task, logtype),
-        limit=limit,
-        page=page,
-        reverse=reverse_order,
-        raw=raw_log
-    )
-    return hashlib.sha1(_string.encode('utf-8')).hexdigest()
+def lookup_id(log_key: str, limit: int = 0, page: int = 1, reverse_order: bool = False, raw_log: bool = False):
+    "construct a unique id to be used with stream_key and result_key, based on the log_cache_id of a task"
+    _string = f"{log_key}_{limit}_{page}_{reverse_order}_{raw_log}"
+    # 128-bit blake2b is plenty for cache keys and cheaper to compute than sha1
+    return hashlib.blake2b(_string.encode('utf-8'), digest_size=16).hexdigest()
 
 
 def pathspec_for_task(task: Dict):
     "pathspec for a task"
     # Prefer run_id over run_number
     # Prefer task_name over task_id
-    return "{flow_id}/{run_id}/{step_name}/{task_name}".format(
-        flow_id=task['flow_id'],
-        run_id=task.get('run_id') or task['run_number'],
-        step_name=task['step_name'],
-        task_name=task.get('task_name') or task['task_id']
-    )
+    run_id = task.get('run_id') or task['run_number']
+    task_name = task.get('task_name') or task['task_id']
+    return f"{task['flow_id']}/{run_id}/{task['step_name']}/{task_name}"
+
+
+def _json_dumps(obj) -> bytes:
+    "serialize obj to JSON, using orjson when it is available"
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def _json_loads(blob):
+    "deserialize JSON, using orjson when it is available"
+    if orjson is not None:
+        return orjson.loads(blob)
+    return json.loads(blob)
 
 
 def _datetime_to_epoch(datetime) -> Optional[int]:
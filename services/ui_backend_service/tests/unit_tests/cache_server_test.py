@@ -0,0 +1,123 @@
+import pytest
+import threading
+from collections import deque
+
+from services.ui_backend_service.data.cache.client import cache_server
+from services.ui_backend_service.data.cache.client.cache_server import Scheduler, persistent_keys, Worker
+
+pytestmark = [pytest.mark.unit_tests]
+
+LOG_ACTION = "services.ui_backend_service.data.cache.get_log_file_action.GetLogFile"
+TASK_ACTION = "services.ui_backend_service.data.cache.get_task_action.GetTask"
+
+
+class MockWorker(object):
+    started = []
+
+    def __init__(self, request, *args):
+        self.request = request
+        self.tempdir = "tempdir"
+
+    def start(self):
+        self.started.append(self.request['idempotency_token'])
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    # skip __init__, which sets up the worker pool and reads requests from stdin.
+    scheduler = Scheduler.__new__(Scheduler)
+    scheduler.hi_prio_requests = deque()
+    scheduler.lo_prio_requests = deque()
+    scheduler.inflight_keys = {}
+    scheduler.hold_back_actions = frozenset([LOG_ACTION])
+    scheduler.inflight_keys_lock = threading.Lock()
+    scheduler.pool = None
+    scheduler.filestore = None
+    MockWorker.started = []
+    monkeypatch.setattr(cache_server, "Worker", MockWorker)
+    return scheduler
+
+
+class FailingStore(object):
+    def open_tempdir(self, *args):
+        return "tempdir"
+
+    def commit(self, *args):
+        raise OSError("disk full")
+
+
+def _request(token, keys, disposable_keys=None, action=LOG_ACTION):
+    return {"idempotency_token": token, "keys": keys, "disposable_keys": disposable_keys,
+            "priority": cache_server.HI_PRIO, "action": action, "stream_key": None}
+
+
+def test_persistent_keys():
+    assert persistent_keys(_request("a", ["log:file", "log:result"], ["log:result"])) == {"log:file"}
+    assert persistent_keys(_request("a", ["log:file", "log:result"])) == {"log:file", "log:result"}
+
+
+def test_reserve_and_release_keys(scheduler):
+    first = _request("first", ["log:file", "log:result:1"], ["log:result:1"])
+    second = _request("second", ["log:file", "log:result:2"], ["log:result:2"])
+    other = _request("other", ["log:other", "log:result:3"], ["log:result:3"])
+
+    assert scheduler.reserve_keys(first)
+    assert not scheduler.reserve_keys(second)
+    assert scheduler.reserve_keys(other)
+
+    scheduler.release_keys(first)
+    assert scheduler.reserve_keys(second)
+    # releasing again must not drop the reservation of the second request
+    scheduler.release_keys(first)
+    assert not scheduler.reserve_keys(first)
+
+
+def test_reserved_keys_expire(scheduler, monkeypatch):
+    first = _request("first", ["log:file"])
+    second = _request("second", ["log:file"])
+    assert scheduler.reserve_keys(first)
+
+    now = cache_server.time.monotonic()
+    monkeypatch.setattr(cache_server.time, "monotonic", lambda: now + cache_server.INFLIGHT_KEYS_TIMEOUT_SECONDS)
+    assert scheduler.reserve_keys(second)
+
+
+def test_schedule_holds_back_requests_with_inflight_keys(scheduler):
+    scheduler.hi_prio_requests.extend([
+        _request("first", ["log:file", "log:result:1"], ["log:result:1"]),
+        _request("second", ["log:file", "log:result:2"], ["log:result:2"]),
+        _request("other", ["log:other"]),
+    ])
+
+    assert scheduler.schedule().request["idempotency_token"] == "first"
+    # second shares log:file with the running worker, so it is put back in the queue
+    assert scheduler.schedule().request["idempotency_token"] == "other"
+    assert scheduler.schedule() is None
+    assert [r["idempotency_token"] for r in scheduler.hi_prio_requests] == ["second"]
+
+    scheduler._terminate_callback(MockWorker(_request("first", ["log:file"])))
+    assert scheduler.schedule().request["idempotency_token"] == "second"
+    assert MockWorker.started == ["first", "other", "second"]
+    assert not scheduler.hi_prio_requests
+
+
+
+def test_schedule_does_not_hold_back_other_actions(scheduler):
+    scheduler.hi_prio_requests.extend([
+        _request("first", ["task:1", "task:2"], action=TASK_ACTION),
+        _request("second", ["task:2", "task:3"], action=TASK_ACTION),
+    ])
+
+    assert scheduler.schedule().request["idempotency_token"] == "first"
+    assert scheduler.schedule().request["idempotency_token"] == "second"
+    assert not scheduler.inflight_keys
+
+def test_worker_terminate_releases_keys_when_commit_fails(scheduler):
+    request = _request("first", ["log:file"])
+    assert scheduler.reserve_keys(request)
+
+    worker = Worker(request, FailingStore(), None, terminate_callback=scheduler._terminate_callback)
+    with pytest.raises(OSError):
+        worker.terminate()
+
+    assert scheduler.reserve_keys(_request("second", ["log:file"]))
@@ -1,12 +1,19 @@
 import pytest
 import datetime
+import tracemalloc
+from collections import OrderedDict
 
-from services.ui_backend_service.data.cache.get_log_file_action import paginated_result, log_cache_id, lookup_id, _datetime_to_epoch
+from services.ui_backend_service.data.cache import get_log_file_action
+from services.ui_backend_service.data.cache.client.cache_client import KeyObjects
+from services.ui_backend_service.data.cache.get_log_file_action import \
+    GetLogFile, STDOUT, paginated_result, log_cache_id, lookup_id, log_result_id, pathspec_for_task, _datetime_to_epoch, _attempt_finished, \
+    pack_log, is_packed_log, PackedLog, get_cached_log_size, cache_log_size
 
 pytestmark = [pytest.mark.unit_tests]
 
 TEST_LOG = list((None, "log line {}".format(i)) for i in range(1, 1001))
 TEST_MFLOG = list((i, "log line {}".format(i)) for i in range(1, 1001))
+TEST_LEGACY_LOG = "\n".join(line for _, line in TEST_LOG)
 
 @pytest.mark.parametrize(
     "test_log, first_expected_item",
@@ -73,6 +80,18 @@ async def test_paginated_result_ordering(test_log):
     )
     assert [obj["line"] for obj in body["content"]] == [line for _, line in test_log[::-1]]
 
+@pytest.mark.parametrize("test_log", [TEST_LOG, TEST_MFLOG])
+async def test_paginated_result_reverse_with_limit(test_log):
+    body = paginated_result(
+        content=test_log, page=2,
+        limit=5, reverse_order=True,
+        output_raw=False
+    )
+
+    assert body["pages"] == 200
+    assert [obj["row"] for obj in body["content"]] == [994, 993, 992, 991, 990]
+    assert [obj["line"] for obj in body["content"]] == list("log line {}".format(i) for i in range(995, 990, -1))
+
 @pytest.mark.parametrize("test_log", [TEST_LOG, TEST_MFLOG])
 async def test_paginated_result_raw_output(test_log):
     body = paginated_result(
@@ -86,6 +105,71 @@ async def test_paginated_result_raw_output(test_log):
     assert body["content"] == "\n".join(line for _, line in test_log)
 
 
+@pytest.mark.parametrize("test_log", [TEST_LOG, TEST_MFLOG])
+async def test_packed_log(test_log):
+    blob = pack_log(1234, test_log)
+    assert is_packed_log(blob)
+
+    packed = PackedLog(blob)
+    assert packed.log_size == 1234
+    assert len(packed) == len(test_log)
+    assert list(packed) == test_log
+    assert packed[0] == test_log[0]
+    assert packed[-1] == test_log[-1]
+    assert packed[10:20] == test_log[10:20]
+    assert packed[20:10] == []
+
+
+async def test_packed_log_unicode():
+    test_log = [(None, ""), (1, "ünïcödé ✓"), (2, "")]
+    assert list(PackedLog(pack_log(0, test_log))) == test_log
+
+
+async def test_packed_log_empty():
+    packed = PackedLog(pack_log(0, []))
+    assert len(packed) == 0
+    assert list(packed) == []
+    assert packed.text() == ""
+
+    packed = PackedLog(pack_log(0, ""))
+    assert list(packed) == [(None, "")]
+    assert packed.text() == ""
+
+
+async def test_packed_log_legacy_text():
+    text = "first\n\nünïcödé ✓\n"
+    packed = PackedLog(pack_log(0, text))
+    assert list(packed) == [(None, "first"), (None, ""), (None, "ünïcödé ✓"), (None, "")]
+    assert packed.text() == text
+
+
+async def test_is_packed_log():
+    assert not is_packed_log(None)
+    assert not is_packed_log(b"")
+    assert not is_packed_log(b'{"log_size": 0, "content": []}')
+
+
+@pytest.mark.parametrize(
+    "page, limit, reverse_order, output_raw",
+    [
+        (1, 0, False, False),
+        (2, 5, False, False),
+        (2, 5, True, False),
+        (1, 0, True, False),
+        (300, 5, False, False),
+        (1, 5, False, True),
+    ]
+)
+async def test_paginated_result_packed_log(page, limit, reverse_order, output_raw):
+    for packed, test_log in [
+        (PackedLog(pack_log(0, TEST_LOG)), TEST_LOG),
+        (PackedLog(pack_log(0, TEST_MFLOG)), TEST_MFLOG),
+        (PackedLog(pack_log(0, TEST_LEGACY_LOG)), TEST_LOG),
+    ]:
+        assert paginated_result(packed, page, limit, reverse_order, output_raw) == \
+            paginated_result(test_log, page, limit, reverse_order, output_raw)
+
+
 async def test_log_cache_id_uniqueness():
     first_task = {
         "flow_id": "TestFlow",
@@ -117,6 +201,33 @@ async def test_log_cache_id_uniqueness():
     assert log_cache_id(first_task, "stdout") != log_cache_id(second_task, "stdout")
 
 
+async def test_log_cache_id_with_precomputed_pathspec():
+    task = {
+        "flow_id": "TestFlow",
+        "run_number": "1234",
+        "step_name": "test_step",
+        "task_id": "1234",
+        "attempt_id": "0"
+    }
+
+    assert log_cache_id(task, "stdout", pathspec_for_task(task)) == log_cache_id(task, "stdout")
+
+
+async def test_pathspec_for_task():
+    task = {
+        "flow_id": "TestFlow",
+        "run_number": 1234,
+        "step_name": "test_step",
+        "task_id": 456,
+    }
+    assert pathspec_for_task(task) == "TestFlow/1234/test_step/456"
+
+    # run_id and task_name are preferred when present
+    assert pathspec_for_task({**task, "run_id": "argo-run", "task_name": "task-name"}) == \
+        "TestFlow/argo-run/test_step/task-name"
+    assert pathspec_for_task({**task, "run_id": None, "task_name": None}) == "TestFlow/1234/test_step/456"
+
+
 async def test_lookup_id_uniqueness():
     first_task = {
         "flow_id": "TestFlow",
@@ -142,26 +253,194 @@ async def test_lookup_id_uniqueness():
         "attempt_id": "0"
     }
 
-    assert lookup_id(first_task, "stdout", 0, 1, False, False) == \
-        lookup_id(first_task, "stdout", 0, 1, False, False)
+    assert lookup_id(log_cache_id(first_task, "stdout"), 0, 1, False, False) == \
+        lookup_id(log_cache_id(first_task, "stdout"), 0, 1, False, False)
+
+    assert lookup_id(log_cache_id(first_task, "stdout"), 0, 1, False, False) != \
+        lookup_id(log_cache_id(first_task_second_attempt, "stdout"), 0, 1, False, False)
+
+    assert lookup_id(log_cache_id(first_task, "stdout"), 0, 1, False, False) != \
+        lookup_id(log_cache_id(second_task, "stdout"), 0, 1, False, False)
+
+    assert lookup_id(log_cache_id(first_task, "stdout"), 0, 1, False, False) != \
+        lookup_id(log_cache_id(first_task, "stdout"), 1, 1, False, False)
+
+    assert lookup_id(log_cache_id(first_task, "stdout"), 1, 1, False, False) != \
+        lookup_id(log_cache_id(first_task, "stdout"), 1, 0, False, False)
+
+    assert lookup_id(log_cache_id(first_task, "stdout"), 1, 1, False, False) != \
+        lookup_id(log_cache_id(first_task, "stdout"), 1, 1, True, False)
+
+    assert lookup_id(log_cache_id(first_task, "stdout"), 1, 1, False, False) != \
+        lookup_id(log_cache_id(first_task, "stdout"), 1, 1, False, True)
+
+
+async def test_log_size_cache(monkeypatch):
+    monkeypatch.setattr(get_log_file_action, "_log_size_cache", OrderedDict())
+    key = ("TestFlow/1234/test_step/1234", 0, "stdout")
+
+    assert get_cached_log_size(key) is None
+    cache_log_size(key, 100)
+    assert get_cached_log_size(key) == 100
+    assert get_cached_log_size(("TestFlow/1234/test_step/1234", 1, "stdout")) is None
+
+    # sizes of unfinished attempts expire
+    monkeypatch.setattr(get_log_file_action, "LOG_SIZE_CACHE_TTL_SECONDS", -1)
+    cache_log_size(key, 200)
+    assert get_cached_log_size(key) is None
+
+    # sizes of finished attempts are kept
+    cache_log_size(key, 300, finished=True)
+    assert get_cached_log_size(key) == 300
+
+
+async def test_log_size_cache_eviction(monkeypatch):
+    monkeypatch.setattr(get_log_file_action, "_log_size_cache", OrderedDict())
+    monkeypatch.setattr(get_log_file_action, "LOG_SIZE_CACHE_MAX_ITEMS", 2)
+
+    cache_log_size("first", 1)
+    cache_log_size("second", 2)
+    assert get_cached_log_size("first") == 1
+    cache_log_size("third", 3)
+
+    # least recently used key is evicted
+    assert get_cached_log_size("second") is None
+    assert get_cached_log_size("first") == 1
+    assert get_cached_log_size("third") == 3
+
+
+@pytest.mark.parametrize("task, finished", [
+    ({"attempt_ok": True, "finished_at": 1000}, True),
+    ({"attempt_ok": False, "finished_at": 1000}, True),
+    # finished_at falls back to the last heartbeat of a running task whose heartbeats have lapsed
+    ({"attempt_ok": None, "finished_at": 1000}, False),
+    ({"attempt_ok": True, "finished_at": None}, False),
+])
+async def test_attempt_finished(task, finished):
+    assert _attempt_finished(task) == finished
+
+
+class MockTask():
+    def __init__(self, log):
+        self.log = log
+        self.stdout_size = len(log)
+        self.metadata_dict = {}
+        self.fetches = 0
+
+    def loglines(self, stream):
+        self.fetches += 1
+        for timestamp, line in self.log:
+            yield datetime.datetime.fromtimestamp(timestamp / 1000, tz=datetime.timezone.utc) if timestamp else None, line
+
+
+async def test_execute_ignores_stale_cached_log_size(monkeypatch):
+    monkeypatch.setattr(get_log_file_action, "_log_size_cache", OrderedDict())
+    task = MockTask(TEST_MFLOG[:20])
+    monkeypatch.setattr(get_log_file_action, "get_task", lambda pathspec, attempt: task)
+    task_dict = {"flow_id": "TestFlow", "run_number": "1", "step_name": "test_step", "task_id": "1", "attempt_id": 0}
+    log_key = log_cache_id(task_dict, STDOUT)
+
+    # this process last saw a smaller log, while another worker has already packed the grown log
+    cache_log_size(("TestFlow/1/test_step/1", 0, STDOUT), 10)
+    packed = pack_log(20, TEST_MFLOG[:20])
+    message = {"task": task_dict, "logtype": STDOUT, "limit": 0, "page": 1, "reverse_order": False, "raw_log": False}
+    results = GetLogFile.execute(message=message, existing_keys={log_key: packed}, stream_output=lambda _: None)
+
+    assert results[log_key] is packed
+    assert get_cached_log_size(("TestFlow/1/test_step/1", 0, STDOUT)) == 20
+
+
+async def test_execute_refetches_rewritten_log(monkeypatch):
+    monkeypatch.setattr(get_log_file_action, "_log_size_cache", OrderedDict())
+    task = MockTask([(1, "rewritten")] + TEST_MFLOG[:20])
+    monkeypatch.setattr(get_log_file_action, "get_task", lambda pathspec, attempt: task)
+    task_dict = {"flow_id": "TestFlow", "run_number": "1", "step_name": "test_step", "task_id": "1", "attempt_id": 0}
+    log_key = log_cache_id(task_dict, STDOUT)
+
+    message = {"task": task_dict, "logtype": STDOUT, "limit": 0, "page": 1, "reverse_order": False, "raw_log": False}
+    results = GetLogFile.execute(message=message, existing_keys={log_key: pack_log(10, TEST_MFLOG[:10])}, stream_output=lambda _: None)
+
+    assert task.fetches == 2
+    assert results[log_key] == pack_log(21, task.log)
+
+
+@pytest.mark.parametrize("previous, content", [
+    (TEST_MFLOG[:500], TEST_MFLOG),
+    (TEST_LOG[:1], TEST_LOG),
+    ([], TEST_MFLOG),
+    (TEST_MFLOG[:499] + [(500, "log line")], TEST_MFLOG),  # last line was incomplete
+    ("\n".join(line for _, line in TEST_LOG[:500]), TEST_LEGACY_LOG),
+    (TEST_LEGACY_LOG[:-3], TEST_LEGACY_LOG),
+])
+async def test_packed_log_extended(previous, content):
+    previous_log = PackedLog(pack_log(1, previous))
+
+    assert previous_log.extended(2, content) == pack_log(2, content)
+
+
+@pytest.mark.parametrize("previous, content", [
+    (TEST_MFLOG[:500], [(1, "rewritten")] + TEST_MFLOG),
+    (TEST_MFLOG[:500], TEST_MFLOG[:100]),
+    (TEST_MFLOG[:500], [(ts + 1, line) for ts, line in TEST_MFLOG]),
+])
+async def test_packed_log_extended_rewritten(previous, content):
+    assert PackedLog(pack_log(1, previous)).extended(2, content) is None
+
+
+async def test_packed_log_extended_rewritten_legacy_text():
+    previous_log = PackedLog(pack_log(1, TEST_LEGACY_LOG[:500]))
+    content = "rewritten\n" + TEST_LEGACY_LOG
+
+    assert previous_log.extended(2, content) == pack_log(2, content)
+
+
+async def test_packed_log_extended_does_not_keep_skipped_lines():
+    def log(count=50000):
+        # loglines are created as they are read, like they are from the Metaflow client
+        return ((i, "log line with some content {}".format(i)) for i in range(count))
+    previous_log = PackedLog(pack_log(1, log(49000)))
+
+    def peak_memory(pack):
+        tracemalloc.start()
+        try:
+            pack()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    # the packed output dominates the peak either way, while keeping the skipped lines would more than triple it
+    assert peak_memory(lambda: previous_log.extended(2, log())) < 1.5 * peak_memory(lambda: pack_log(2, log()))
+
+
+async def test_format_request_keys():
+    task = {
+        "flow_id": "TestFlow",
+        "run_number": "1234",
+        "step_name": "test_step",
+        "task_id": "1234",
+        "attempt_id": "0"
+    }
+
+    _, keys, stream_key, disposable_keys, _ = GetLogFile.format_request(task, "stdout", 5, 2, True, False)
+    log_key, result_key = keys
 
-    assert lookup_id(first_task, "stdout", 0, 1, False, False) != \
-        lookup_id(first_task_second_attempt, "stdout", 0, 1, False, False)
+    assert log_key == log_cache_id(task, "stdout")
+    assert result_key == log_result_id(log_key, 5, 2, True, False)
+    assert stream_key == "log:stream:%s" % lookup_id(log_key, 5, 2, True, False)
+    assert disposable_keys == [stream_key, result_key]
 
-    assert lookup_id(first_task, "stdout", 0, 1, False, False) != \
-        lookup_id(second_task, "stdout", 0, 1, False, False)
 
-    assert lookup_id(first_task, "stdout", 0, 1, False, False) != \
-        lookup_id(first_task, "stdout", 1, 1, False, False)
+async def test_response_reads_only_result_key(tmp_path):
+    log_path = tmp_path / "log"
+    result_path = tmp_path / "result"
+    log_path.write_bytes(bytes(pack_log(0, TEST_LOG)))
+    result_path.write_bytes(b'{"content": [], "pages": 1}')
 
-    assert lookup_id(first_task, "stdout", 1, 1, False, False) != \
-        lookup_id(first_task, "stdout", 1, 0, False, False)
+    key_objs = KeyObjects({"log:file:a": str(log_path), "log:result:b": str(result_path)})
+    log_path.unlink()
 
-    assert lookup_id(first_task, "stdout", 1, 1, False, False) != \
-        lookup_id(first_task, "stdout", 1, 1, True, False)
+    assert GetLogFile.response(key_objs) == {"content": [], "pages": 1}
 
-    assert lookup_id(first_task, "stdout", 1, 1, False, False) != \
-        lookup_id(first_task, "stdout", 1, 1, False, True)
 
 datetime_expectations = [
     (None, None),